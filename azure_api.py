@@ -1,143 +1,386 @@
-import json
+import functools
+import threading
+import time
+from collections import OrderedDict
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
-from datetime import datetime, timedelta
-import pytz
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
 
 # Timezone Setup
-IST = pytz.timezone("Asia/Kolkata")
+IST = ZoneInfo("Asia/Kolkata")
+
+# Longest wait honored from a Retry-After header; the script thread blocks while it sleeps
+_MAX_RETRY_AFTER = 10
+
+class _CappedRetry(Retry):
+    """Retry that honors Retry-After, but never waits longer than _MAX_RETRY_AFTER seconds."""
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, _MAX_RETRY_AFTER)
+
+# Back off exponentially with jitter and retry when Azure is throttling (429) or
+# briefly unavailable; the jitter keeps sessions throttled together from retrying in step
+_RETRY = _CappedRetry(
+    total=3,
+    backoff_factor=0.5,
+    backoff_jitter=0.5,
+    backoff_max=_MAX_RETRY_AFTER,
+    status_forcelist=(429, 500, 502, 503, 504),
+    respect_retry_after_header=True,
+    allowed_methods=frozenset(["POST"]),
+    raise_on_status=False
+)
+
+# Shared session so repeat calls reuse the pooled TLS connection to Azure
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=_RETRY))
+_SESSION.headers["Connection"] = "keep-alive"
+
+# One parser per thread: each Streamlit session runs its script on its own thread,
+# and a parser refuses to parse again while a document it returned is still alive
+_SIMD_PARSERS = threading.local()
+
+def _simd_parser():
+    """Returns this thread's simdjson parser, creating it on first use."""
+    parser = getattr(_SIMD_PARSERS, "parser", None)
+    if parser is None:
+        parser = _SIMD_PARSERS.parser = simdjson.Parser()
+    return parser
+
+SYSTEM_PROMPT = """
+You are a highly capable calendar assistant. Current date and time is {current_date} in the Asia/Kolkata timezone.
+You will receive user inputs related to calendar events. Your job is to map the user's request to a specific calendar action 
+(create, find, delete, reschedule) and provide structured event details as needed using tool calling.
+
+When handling deletion requests:
+- If the user asks to delete events for a specific day, use the "delete" action, not "find"
+- For "tomorrow", use the next day's date range
+- For "today", use the current day's date range
+- Set both start_time and end_time to cover the full day (00:00:00 to 23:59:59)
+
+When handling rescheduling requests:
+- Use the "reschedule" action directly, not "find" then "reschedule"
+- Preserve the original event's time of day when moving to a new date
+- For specific date changes (e.g., "from X to Y"), use those exact dates
+- Always include both new_start_time and new_end_time in the response
+""".strip()
+
+# The tool schema never changes between requests, so it is built once and shared
+CALENDAR_TOOLS = [{
+    "type": "function",
+    "function": {
+        "name": "calendar_action",
+        "description": "Handles creating, finding, deleting, or rescheduling events.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "action": {
+                    "type": "string",
+                    "enum": ["create", "find", "delete", "reschedule"],
+                    "description": "The type of calendar action requested by the user. Use 'delete' for deletion requests, not 'find'."
+                },
+                "event": {
+                    "type": "object",
+                    "properties": {
+                        "summary": {"type": "string", "description": "The title or summary of the event. Use empty string for bulk deletions."},
+                        "start_time": {"type": "string", "description": "The start time of the event in ISO format with timezone."},
+                        "end_time": {"type": "string", "description": "The end time of the event in ISO format with timezone."},
+                        "new_start_time": {"type": "string", "description": "The new start time for rescheduling. When rescheduling, provide this directly without using find action first."},
+                        "new_end_time": {"type": "string", "description": "The new end time for rescheduling. Should maintain the same duration as the original event."},
+                        "description": {"type": "string", "description": "A description or purpose of the event."}
+                    },
+                    "required": ["summary", "start_time"]
+                }
+            },
+            "required": ["action"]
+        }
+    }
+}]
+
+CALENDAR_TOOL_CHOICE = {"type": "function", "function": {"name": "calendar_action"}}
+
+def _dumps(obj):
+    """Serializes obj to JSON bytes with orjson, or the stdlib fallback."""
+    data = _json.dumps(obj)
+    return data if isinstance(data, bytes) else data.encode()
+
+# Pre-serialized once so each request only encodes its messages
+_TOOLS_JSON = _dumps(CALENDAR_TOOLS)
+_TOOL_CHOICE_JSON = _dumps(CALENDAR_TOOL_CHOICE)
 
 def get_current_date():
     """Returns the current datetime in IST timezone."""
     return datetime.now(IST)
 
-def parse_azure_response(response_text):
-    """Parses Azure OpenAI response and extracts calendar action details or function calls."""
+@functools.lru_cache(maxsize=1)
+def _format_date(timestamp):
+    """Formats a whole-second timestamp; calls within the same second reuse the string."""
+    return datetime.fromtimestamp(timestamp, IST).isoformat(sep=" ", timespec="seconds")
+
+def _warn_if_near_rate_limit(headers):
+    """Shows a toast when Azure reports less than 10% of the token quota remaining."""
+    remaining = headers.get("x-ratelimit-remaining-tokens")
+    limit = headers.get("x-ratelimit-limit-tokens")
+    if not remaining or not limit:
+        return
+    try:
+        if int(remaining) < int(limit) * 0.1:
+            st.toast("Azure OpenAI is close to its rate limit; responses may slow down.", icon="⚠️")
+    except ValueError:
+        pass
+
+# Raised when the response is valid JSON but not shaped like a chat completion
+_SHAPE_ERRORS = (KeyError, IndexError, TypeError, AttributeError)
+
+def _first_message(response_body):
+    """Returns choices[0].message from the raw response without decoding the rest of it."""
+    if simdjson is not None:
+        try:
+            doc = _simd_parser().parse(response_body)
+        except ValueError:
+            pass
+        else:
+            try:
+                # Copy out into plain Python objects so the parser can be reused
+                return doc.at_pointer("/choices/0/message").as_dict()
+            except _SHAPE_ERRORS:
+                return {}
+
+    response_data = _json.loads(response_body)
+    try:
+        message = response_data.get("choices", [{}])[0].get("message", {})
+    except _SHAPE_ERRORS:
+        return {}
+    return message if isinstance(message, dict) else {}
+
+def parse_azure_response(response_body):
+    """Parses the raw Azure OpenAI response bytes and extracts calendar action details or function calls."""
     try:
-        response_data = json.loads(response_text)
-        tool_calls = response_data.get("choices", [{}])[0].get("message", {}).get("tool_calls", [])
+        message = _first_message(response_body)
+        tool_calls = message.get("tool_calls") or []
         
         # Extract function call arguments if present
         if tool_calls and tool_calls[0]["type"] == "function" and "arguments" in tool_calls[0]["function"]:
             # Parse the arguments which are in JSON string format
             arguments_str = tool_calls[0]["function"]["arguments"]
-            arguments = json.loads(arguments_str)
+            arguments = _json.loads(arguments_str)
+            if not isinstance(arguments, dict):
+                st.error("Error processing response: tool call arguments are not an object")
+                return {"action": "error", "content": "Response parsing error."}
             return arguments
             
         # Fallback to message content
-        message = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
-        return {"action": "message", "content": message.strip() or "Received an empty response from the assistant."}
+        content = message.get("content") or ""
+        return {"action": "message", "content": content.strip() or "Received an empty response from the assistant."}
             
-    except (json.JSONDecodeError, IndexError, KeyError) as e:
+    except (_json.JSONDecodeError, IndexError, KeyError) as e:
         st.error(f"Error processing response: {str(e)}")
         return {"action": "error", "content": "Response parsing error."}
 
-def call_azure_openai(user_input):
+def parse_streamed_response(streamed_text):
+    """Parses the text collected from stream_azure_openai into a calendar action."""
+    streamed_text = streamed_text.strip()
+    if not streamed_text:
+        # Nothing arrived, typically because the stream failed and already reported why
+        return {"action": "error", "content": "Received an empty response from the assistant."}
+    try:
+        parsed = _json.loads(streamed_text)
+    except _json.JSONDecodeError:
+        parsed = None
+    if isinstance(parsed, dict):
+        return parsed
+    # The model answered in plain text rather than through the tool call
+    return {"action": "message", "content": streamed_text}
+
+@functools.lru_cache(maxsize=1)
+def _azure_url():
+    """Returns the chat completions URL built from secrets, computed once per process."""
+    # The endpoint in secrets should NOT contain api-version; drop any query string and trailing slashes
+    base_url = st.secrets['AZURE_OPENAI_ENDPOINT'].split('?')[0].strip().rstrip('/')
+    
+    # Use a current API version
+    api_version = "2023-05-15"
+    return f"{base_url}?api-version={api_version}"
+
+@functools.lru_cache(maxsize=1)
+def _azure_headers():
+    """Returns the request headers built from secrets, computed once per process."""
+    return {
+        "Content-Type": "application/json",
+        "api-key": st.secrets['AZURE_OPENAI_API_KEY']
+    }
+
+def _build_body(user_input, stream=False):
+    """Returns the serialized chat completions request body for the user's input."""
+    current_date = _format_date(int(time.time()))
+    messages_json = _dumps([
+        {"role": "system", "content": SYSTEM_PROMPT.format(current_date=current_date)},
+        {"role": "user", "content": user_input.strip()}
+    ])
+    return (
+        b'{"messages":' + messages_json
+        + b',"tools":' + _TOOLS_JSON
+        + b',"tool_choice":' + _TOOL_CHOICE_JSON
+        # Deterministic output is what makes reusing cached responses sound
+        + b',"temperature":0'
+        + (b',"stream":true' if stream else b'')
+        + b'}'
+    )
+
+def _iter_stream_chunks(response):
+    """Yields each decoded `data:` frame of a server-sent events completion stream."""
+    for line in response.iter_lines():
+        if not line.startswith(b"data:"):
+            continue
+        data = line[len(b"data:"):].strip()
+        if data == b"[DONE]":
+            break
+        yield _json.loads(data)
+
+# Successful responses per (input, hour), shared by the blocking and streaming paths
+_RESPONSE_CACHE = OrderedDict()
+_RESPONSE_CACHE_SIZE = 128
+_RESPONSE_CACHE_TTL = 300
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+def _cache_key(user_input):
+    # Collapse whitespace but keep case, which the model copies into event titles.
+    # The hour keeps "today" from outliving midnight; the TTL keeps relative times
+    # such as "in two hours" close to right
+    return " ".join(user_input.split()), get_current_date().strftime("%Y-%m-%d-%H")
+
+def _cached_response(key):
+    with _RESPONSE_CACHE_LOCK:
+        entry = _RESPONSE_CACHE.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            del _RESPONSE_CACHE[key]
+            return None
+        _RESPONSE_CACHE.move_to_end(key)
+        return response
+
+def _remember_response(key, response):
+    # Errors are not memoized, so they are retried on the next call
+    if response.get("action") == "error":
+        return
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE[key] = (time.monotonic() + _RESPONSE_CACHE_TTL, response)
+        _RESPONSE_CACHE.move_to_end(key)
+        if len(_RESPONSE_CACHE) > _RESPONSE_CACHE_SIZE:
+            _RESPONSE_CACHE.popitem(last=False)
+
+def call_azure_openai(user_input, render=None):
+    """Sends user input to Azure OpenAI and returns parsed response using tool calling.
+
+    Successful responses are cached for five minutes (within the same hour), so
+    repeating the same request returns immediately without another API call.
+    When `render` is given (e.g. st.write_stream), the response is streamed
+    through it as it arrives; it must return the joined text, which is then
+    parsed.
+    """
+    key = _cache_key(user_input)
+    response = _cached_response(key)
+    if response is None:
+        if render is None:
+            response = _request_completion(key[0])
+        else:
+            try:
+                response = parse_streamed_response(render(stream_azure_openai(key[0])))
+            except StreamError as e:
+                # Already reported; whatever arrived before the failure is discarded
+                return {"action": "error", "content": str(e)}
+        _remember_response(key, response)
+    return response
+
+def _http_error(response):
+    """Reports a failed Azure response and returns the matching error action."""
+    detail = response.content[:500].decode("utf-8", "replace")
+    st.error(f"Azure HTTP {response.status_code}: {detail}")
+    return {"action": "error", "content": f"Azure OpenAI request failed with HTTP {response.status_code}"}
+
+def _request_completion(user_input):
     """Sends user input to Azure OpenAI and returns parsed response using tool calling."""
     try:
-        current_date = get_current_date().strftime("%Y-%m-%d %H:%M:%S")
-        
         # Get credentials from secrets
         try:
-            # The endpoint in secrets should NOT contain api-version
-            endpoint_with_version = st.secrets['AZURE_OPENAI_ENDPOINT']
-            api_key = st.secrets['AZURE_OPENAI_API_KEY']
-            
-            # Extract just the base URL without any query parameters
-            base_url = endpoint_with_version.split('?')[0]
-            
-            # Remove any trailing spaces or slashes
-            base_url = base_url.strip()
-            while base_url.endswith('/'):
-                base_url = base_url[:-1]
-                
-            # Use a current API version
-            api_version = "2023-05-15"
-            
-            # Create clean URL with API version
-            url_with_params = f"{base_url}?api-version={api_version}"
-            
+            url_with_params, headers = _azure_url(), _azure_headers()
         except Exception as e:
             st.error(f"Error accessing secrets: {str(e)}")
             return {"action": "error", "content": "Configuration error - API credentials not found"}
         
-        # Construct the headers
-        headers = {
-            "Content-Type": "application/json",
-            "api-key": api_key
-        }
+        body = _build_body(user_input)
         
-        payload = {
-            "messages": [
-                {"role": "system", "content": f"""
-                    You are a highly capable calendar assistant. Current date and time is {current_date} in the Asia/Kolkata timezone.
-                    You will receive user inputs related to calendar events. Your job is to map the user's request to a specific calendar action 
-                    (create, find, delete, reschedule) and provide structured event details as needed using tool calling.
-
-                    When handling deletion requests:
-                    - If the user asks to delete events for a specific day, use the "delete" action, not "find"
-                    - For "tomorrow", use the next day's date range
-                    - For "today", use the current day's date range
-                    - Set both start_time and end_time to cover the full day (00:00:00 to 23:59:59)
-
-                    When handling rescheduling requests:
-                    - Use the "reschedule" action directly, not "find" then "reschedule"
-                    - Preserve the original event's time of day when moving to a new date
-                    - For specific date changes (e.g., "from X to Y"), use those exact dates
-                    - Always include both new_start_time and new_end_time in the response
-                """.strip()},
-                {"role": "user", "content": user_input.strip()}
-            ],
-            "tools": [{
-                "type": "function",
-                "function": {
-                    "name": "calendar_action",
-                    "description": "Handles creating, finding, deleting, or rescheduling events.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "action": {
-                                "type": "string",
-                                "enum": ["create", "find", "delete", "reschedule"],
-                                "description": "The type of calendar action requested by the user. Use 'delete' for deletion requests, not 'find'."
-                            },
-                            "event": {
-                                "type": "object",
-                                "properties": {
-                                    "summary": {"type": "string", "description": "The title or summary of the event. Use empty string for bulk deletions."},
-                                    "start_time": {"type": "string", "description": "The start time of the event in ISO format with timezone."},
-                                    "end_time": {"type": "string", "description": "The end time of the event in ISO format with timezone."},
-                                    "new_start_time": {"type": "string", "description": "The new start time for rescheduling. When rescheduling, provide this directly without using find action first."},
-                                    "new_end_time": {"type": "string", "description": "The new end time for rescheduling. Should maintain the same duration as the original event."},
-                                    "description": {"type": "string", "description": "A description or purpose of the event."}
-                                },
-                                "required": ["summary", "start_time"]
-                            }
-                        },
-                        "required": ["action"]
-                    }
-                }
-            }],
-            "tool_choice": {"type": "function", "function": {"name": "calendar_action"}}
-        }
-        
-        try:
-            with st.spinner("Processing your request..."):
-                response = requests.post(url_with_params, headers=headers, json=payload)
-                response.raise_for_status()
-                return parse_azure_response(response.text)
-        except requests.exceptions.HTTPError as e:
-            st.error(f"HTTP Error: {e}")
-            if hasattr(e, 'response') and hasattr(e.response, 'text'):
-                st.error(f"Response content: {e.response.text}")
-            return {"action": "error", "content": str(e)}
+        # The caller already shows a spinner around this call
+        response = _SESSION.post(url_with_params, headers=headers, data=body, stream=False)
+        _warn_if_near_rate_limit(response.headers)
+        if response.status_code >= 400:
+            return _http_error(response)
+        return parse_azure_response(response.content)
             
     except requests.exceptions.RequestException as e:
         st.error(f"API request failed: {str(e)}")
         return {"action": "error", "content": str(e)}
-    except json.JSONDecodeError:
+    except _json.JSONDecodeError:
         st.error("Failed to parse Azure OpenAI response.")
         return {"action": "error", "content": "Response parsing error."}
     except Exception as e:
         st.error(f"Unexpected error: {str(e)}")
-        return {"action": "error", "content": str(e)}
\ No newline at end of file
+        return {"action": "error", "content": str(e)}
+
+class StreamError(Exception):
+    """Raised by stream_azure_openai once it has reported why the stream failed."""
+
+def stream_azure_openai(user_input):
+    """Sends user input to Azure OpenAI with streaming enabled and yields the response text as it arrives.
+
+    The yielded fragments are the tool call arguments (or plain message text);
+    join them and pass the result to parse_streamed_response. If the request
+    fails, possibly after some fragments were already yielded, the error is
+    shown and StreamError is raised, so a truncated reply is never parsed.
+    """
+    try:
+        url_with_params, headers = _azure_url(), _azure_headers()
+    except Exception as e:
+        st.error(f"Error accessing secrets: {str(e)}")
+        raise StreamError("Configuration error - API credentials not found") from e
+    
+    body = _build_body(user_input, stream=True)
+    
+    try:
+        with _SESSION.post(url_with_params, headers=headers, data=body, stream=True) as response:
+            _warn_if_near_rate_limit(response.headers)
+            if response.status_code >= 400:
+                raise StreamError(_http_error(response)["content"])
+            for chunk in _iter_stream_chunks(response):
+                # The first frame only carries content filter results and has no choices
+                for choice in chunk.get("choices") or []:
+                    delta = choice.get("delta") or {}
+                    for tool_call in delta.get("tool_calls") or []:
+                        fragment = (tool_call.get("function") or {}).get("arguments")
+                        if fragment:
+                            yield fragment
+                    if delta.get("content"):
+                        yield delta["content"]
+    except requests.exceptions.RequestException as e:
+        st.error(f"API request failed: {str(e)}")
+        raise StreamError(str(e)) from e
+    except _json.JSONDecodeError as e:
+        st.error("Failed to parse Azure OpenAI response.")
+        raise StreamError("Response parsing error.") from e
@@ -1,153 +1,455 @@
+import functools
+import hmac
+import logging
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import extra_streamlit_components as stx
 import streamlit as st
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 import os
-import json
-import urllib.parse
 
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=1)
+def _secrets():
+    """Return the Google client ID, client secret and redirect URI, read on first use."""
+    return st.secrets["GOOGLE_CLIENT_ID"], st.secrets["GOOGLE_CLIENT_SECRET"], st.secrets["REDIRECT_URI"]
+
+@functools.lru_cache(maxsize=1)
 def get_client_config():
     """Return the Google client configuration from secrets."""
+    client_id, client_secret, redirect_uri = _secrets()
     return {
         "web": {
-            "client_id": st.secrets["GOOGLE_CLIENT_ID"],
+            "client_id": client_id,
             "project_id": "max-calendar-453518",  # You can hardcode this as it's not sensitive
             "auth_uri": "https://accounts.google.com/o/oauth2/auth",
             "token_uri": "https://oauth2.googleapis.com/token",
             "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_secret": st.secrets["GOOGLE_CLIENT_SECRET"],
-            "redirect_uris": [st.secrets["REDIRECT_URI"]]
+            "client_secret": client_secret,
+            "redirect_uris": [redirect_uri]
         }
     }
 
-def get_auth_code_from_url():
-    """Extract authorization code from URL if present."""
-    params = st.query_params
-    if 'code' in params:
-        return params['code']
-    return None
+# The full calendar scope already covers events read/write and read-only access
+SCOPES = ('https://www.googleapis.com/auth/calendar',)
+
+def _new_flow():
+    """Return a new OAuth flow for the app's client config and scopes."""
+    from google_auth_oauthlib.flow import Flow
+    
+    # With include_granted_scopes, users who consented to the old, longer scope list get
+    # those scopes back too; let oauthlib accept the wider grant instead of raising.
+    # oauthlib reads this when a token response is parsed, so it is set only once the
+    # app actually starts an OAuth flow rather than on import.
+    os.environ.setdefault('OAUTHLIB_RELAX_TOKEN_SCOPE', '1')
+    
+    # Flows carry the per-user token once fetch_token runs, so they are never shared.
+    # The callback arrives in a new session with a new flow, so there is no PKCE
+    # verifier to send back; the client secret authenticates the token exchange.
+    return Flow.from_client_config(
+        get_client_config(),
+        scopes=SCOPES,
+        redirect_uri=_secrets()[2],
+        autogenerate_code_verifier=False
+    )
+
+# How long a signed OAuth state value is accepted after it was issued
+STATE_MAX_AGE_NS = 10 * 60 * 10**9
+
+def _sign(payload):
+    """Return the HMAC of a value the app hands to the browser, keyed by the client secret."""
+    return hmac.new(_secrets()[1].encode(), payload.encode(), 'sha256').hexdigest()
+
+def _new_state():
+    """Return a signed OAuth state value of the form nonce:issued_ns:signature."""
+    payload = f"{secrets.token_urlsafe(16)}:{time.time_ns()}"
+    return f"{payload}:{_sign(payload)}"
+
+def _state_is_valid(state, browser_nonce=None):
+    """Check an OAuth state value's signature and age, and optionally its nonce.
+
+    Google redirects back into a brand new Streamlit session, so the state is
+    verified from its signature rather than looked up in session state. The
+    signature only proves the app issued the state; passing the nonce from the
+    browser's cookie also proves the sign-in was started in this browser.
+    """
+    try:
+        nonce, issued_ns, signature = state.split(':')
+        issued_ns = int(issued_ns)
+    except (AttributeError, ValueError):
+        return False
+    # Compare bytes: compare_digest rejects str arguments with non-ASCII characters
+    if not hmac.compare_digest(signature.encode(), _sign(f"{nonce}:{issued_ns}").encode()):
+        return False
+    if browser_nonce is not None and not hmac.compare_digest(nonce.encode(), browser_nonce.encode()):
+        return False
+    return 0 <= time.time_ns() - issued_ns < STATE_MAX_AGE_NS
+
+# Browser cookie holding the nonce of the sign-in started from this browser
+OAUTH_NONCE_COOKIE = 'gcal_oauth_nonce'
+
+def _authorization_url():
+    """Return this session's Google authorization URL, built once and reused across reruns."""
+    auth_url = st.session_state.get('_auth_url')
+    # Rebuild once the embedded state is too old for the callback to accept
+    if auth_url is None or not _state_is_valid(st.session_state.get('_oauth_state')):
+        state = _new_state()
+        st.session_state['_oauth_state'] = state
+        # Offline access returns the refresh token setup_google_oauth relies on
+        auth_url, _ = _new_flow().authorization_url(
+            access_type='offline',
+            include_granted_scopes='true',
+            prompt='consent',
+            state=state
+        )
+        st.session_state['_auth_url'] = auth_url
+        
+        # The callback only accepts a state whose nonce matches this cookie, so a
+        # callback URL generated in someone else's browser cannot sign this one in
+        cookies = _cookie_manager()
+        if cookies is not None:
+            cookies.set(
+                OAUTH_NONCE_COOKIE,
+                state.split(':')[0],
+                expires_at=datetime.now() + timedelta(seconds=STATE_MAX_AGE_NS // 10**9),
+                key='set_oauth_nonce_cookie'
+            )
+    return auth_url
+
+# Refresh this long before expiry so reruns never wait on the token endpoint
+REFRESH_AHEAD = timedelta(minutes=5)
+
+def _refresh_credentials(credentials):
+    """Refresh credentials in place against Google's token endpoint."""
+    from google.auth.transport.requests import Request
+    
+    credentials.refresh(Request())
+
+def _refresh_in_background(credentials):
+    """Refresh a copy of the credentials on a daemon thread unless a refresh is already pending.
+
+    The session's transport keeps using the original object while the thread
+    runs, so nothing it reads changes mid-request; _apply_background_refresh
+    swaps the copy in on a later run.
+    """
+    if st.session_state.get('_refresh_job') is not None:
+        return
+    
+    from google.oauth2.credentials import Credentials
+    
+    refreshed = Credentials(
+        token=None,
+        refresh_token=credentials.refresh_token,
+        token_uri=credentials.token_uri,
+        client_id=credentials.client_id,
+        client_secret=credentials.client_secret,
+        scopes=credentials.scopes
+    )
+    result = {}
+    
+    def refresh():
+        try:
+            _refresh_credentials(refreshed)
+        except Exception:
+            # Once the token has actually expired, a later run refreshes it synchronously
+            logger.warning("Background refresh of Google credentials failed", exc_info=True)
+        else:
+            result['credentials'] = refreshed
+    
+    thread = threading.Thread(target=refresh, daemon=True)
+    st.session_state['_refresh_job'] = (thread, credentials, result)
+    thread.start()
+
+def _apply_background_refresh(credentials):
+    """Swap in credentials refreshed by a finished background job and return the session's credentials."""
+    job = st.session_state.get('_refresh_job')
+    if job is None or job[0].is_alive():
+        return credentials
+    del st.session_state['_refresh_job']
+    
+    thread, original, result = job
+    refreshed = result.get('credentials')
+    # Ignore a result for credentials that were replaced meanwhile, e.g. by a new sign-in
+    if refreshed is None or original is not credentials:
+        return credentials
+    
+    # A new Credentials object also gets its own transport in get_calendar_service
+    st.session_state.google_credentials = refreshed
+    _remember_credentials(refreshed)
+    return refreshed
+
+# Browser cookie that lets a page reload restore the session without the OAuth redirect
+CREDENTIALS_COOKIE = 'gcal_credentials'
+CREDENTIALS_COOKIE_LIFETIME = timedelta(days=30)
+
+def _cookie_manager():
+    """Return the cookie manager rendered by setup_google_oauth for this run."""
+    return st.session_state.get('_cookie_manager')
+
+def _seal_refresh_token(refresh_token):
+    """Return the cookie value for a refresh token: the token followed by its HMAC."""
+    # The prefix keeps a cookie signature from ever passing as an OAuth state signature
+    return f"{refresh_token}:{_sign('refresh_token:' + refresh_token)}"
+
+def _unseal_refresh_token(value):
+    """Return the refresh token from a cookie value, or None unless its HMAC matches."""
+    if not isinstance(value, str):
+        return None
+    refresh_token, _, signature = value.rpartition(':')
+    if not refresh_token:
+        return None
+    expected = _sign('refresh_token:' + refresh_token)
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return None
+    return refresh_token
+
+def _remember_credentials(credentials):
+    """Keep the user's refresh token in a signed browser cookie so reloads can skip re-authentication."""
+    cookies = _cookie_manager()
+    if cookies is None or not credentials.refresh_token:
+        return
+    # Only the refresh token is persisted; access tokens are short-lived and fetched
+    # again on restore, and the client ID and secret come from secrets
+    value = _seal_refresh_token(credentials.refresh_token)
+    if cookies.get(CREDENTIALS_COOKIE) == value:
+        return
+    cookies.set(
+        CREDENTIALS_COOKIE,
+        value,
+        expires_at=datetime.now() + CREDENTIALS_COOKIE_LIFETIME,
+        key='set_credentials_cookie'
+    )
+
+def _forget_credentials():
+    """Remove the credentials cookie, if the browser has one."""
+    cookies = _cookie_manager()
+    if cookies is not None and cookies.get(CREDENTIALS_COOKIE) is not None:
+        cookies.delete(CREDENTIALS_COOKIE, key='delete_credentials_cookie')
+
+def _restore_credentials(value):
+    """Restore session credentials from the cookie written by _remember_credentials and return them.
+
+    Raises ValueError when the cookie was not signed by this app; the returned
+    credentials have no access token yet, so the caller refreshes them first.
+    """
+    from google.oauth2.credentials import Credentials
+    
+    refresh_token = _unseal_refresh_token(value)
+    if refresh_token is None:
+        raise ValueError("The stored credentials cookie is not signed by this app")
+    client_id, client_secret, _ = _secrets()
+    credentials = Credentials(
+        token=None,
+        refresh_token=refresh_token,
+        token_uri=get_client_config()["web"]["token_uri"],
+        client_id=client_id,
+        client_secret=client_secret,
+        scopes=list(SCOPES)
+    )
+    st.session_state.google_credentials = credentials
+    st.session_state.calendar_id = 'primary'
+    return credentials
 
 def setup_google_oauth():
-    """Set up Google OAuth flow and return credentials if already authenticated."""
-    # Initialize session state if needed
-    if 'google_credentials' not in st.session_state:
-        st.session_state.google_credentials = None
+    """Set up Google OAuth flow and return credentials if already authenticated.
+
+    Expired credentials are refreshed with the stored refresh token, and ones
+    that are about to expire are refreshed in the background, so the user is
+    only sent back through the OAuth flow when the refresh token is unusable.
+    A new session (e.g. after a page reload) is restored from the credentials
+    cookie when the browser has one.
+    """
+    # Rendered once per run, per session; never cached across users
+    cookies = stx.CookieManager(key='gcal_cookie_manager')
+    st.session_state['_cookie_manager'] = cookies
+    
+    if st.session_state.get('_signed_out'):
+        _forget_credentials()
+        return None
     
-    if 'calendar_id' not in st.session_state:
-        st.session_state.calendar_id = None
+    # Credentials are only ever present in session state while signed in
+    credentials = st.session_state.get('google_credentials')
+    if credentials is None:
+        stored = cookies.get(CREDENTIALS_COOKIE)
+        if stored:
+            try:
+                credentials = _restore_credentials(stored)
+            except Exception:
+                _forget_credentials()
     
-    # Check if we have credentials
-    if st.session_state.google_credentials:
+    if credentials is not None:
+        credentials = _apply_background_refresh(credentials)
         try:
-            credentials_dict = json.loads(st.session_state.google_credentials)
-            credentials = Credentials.from_authorized_user_info(credentials_dict)
+            # Covers both an expired token and one restored from the cookie without a token
+            if not credentials.valid and credentials.refresh_token:
+                _refresh_credentials(credentials)
+                # Google may hand back a new refresh token; keep the cookie in step
+                _remember_credentials(credentials)
             
             # Check if credentials are valid
             if credentials.valid:
+                # google-auth keeps expiry as a naive UTC datetime
+                now = datetime.now(timezone.utc).replace(tzinfo=None)
+                if credentials.refresh_token and credentials.expiry and credentials.expiry - now < REFRESH_AHEAD:
+                    _refresh_in_background(credentials)
                 return credentials
+            
+            st.warning("Your Google session has expired. Please sign in again.")
         except Exception as e:
             st.error(f"Error with stored credentials: {str(e)}")
-            st.session_state.google_credentials = None
+        del st.session_state.google_credentials
+        _forget_credentials()
     
     return None
 
-def show_auth_screen():
-    """Display the Google authentication button and handle the flow."""
-    # Initialize session state for credentials if not already set
-    if 'google_credentials' not in st.session_state:
-        st.session_state.google_credentials = None
+def handle_oauth_callback():
+    """Complete the sign-in when Google redirects back with an authorization code.
     
-    st.header("Google Calendar Authentication")
+    Returns True once the credentials are stored, so the caller can carry on
+    rendering the signed-in page in the same script run.
+    """
+    # Nearly every run is not a callback, so bail out before anything else is touched
+    params = st.query_params
+    if 'code' not in params:
+        return False
+    auth_code = params['code']
+    if is_authenticated():
+        return False
     
-    # Check for authorization code in URL
-    auth_code = get_auth_code_from_url()
+    cookies = _cookie_manager()
+    browser_nonce = cookies.get(OAUTH_NONCE_COOKIE) if cookies is not None else None
+    if browser_nonce is None and not st.session_state.get('_oauth_cookies_awaited'):
+        # The cookie manager only reports the browser's cookies on the run after
+        # it first renders, and that report triggers a rerun. Stop here until then,
+        # so the sign-in screen does not issue a new nonce over the one being checked
+        st.session_state['_oauth_cookies_awaited'] = True
+        st.info("🔐 Completing authentication...")
+        # Only visible if the report never arrives
+        st.caption("Still here after a few seconds? Start the sign-in again.")
+        st.link_button("Sign in with Google again", _secrets()[2])
+        st.stop()
+    st.session_state.pop('_oauth_cookies_awaited', None)
     
-    if auth_code and not st.session_state.get('google_credentials'):
-        with st.spinner("🔐 Completing authentication..."):
-            try:
-                flow = Flow.from_client_config(
-                    get_client_config(),
-                    scopes=[
-                        'https://www.googleapis.com/auth/calendar',
-                        'https://www.googleapis.com/auth/calendar.events',
-                        'https://www.googleapis.com/auth/calendar.readonly'
-                    ],
-                    redirect_uri=st.secrets["REDIRECT_URI"]
-                )
-                flow.fetch_token(code=auth_code)
-                credentials = flow.credentials
-                
-                # Save credentials
-                st.session_state.google_credentials = credentials.to_json()
-                
-                # Get the user's primary calendar ID
-                service = build('calendar', 'v3', credentials=credentials)
-                calendar_list = service.calendarList().list().execute()
-                
-                # Find the primary calendar
-                primary_calendar = None
-                for calendar_entry in calendar_list.get('items', []):
-                    if calendar_entry.get('primary'):
-                        primary_calendar = calendar_entry
-                        break
-                
-                if primary_calendar:
-                    st.session_state.calendar_id = primary_calendar['id']
-                
-                # Clear the URL parameters
-                st.query_params.clear()
-                
-                st.success("Successfully authenticated with Google!")
-                st.rerun()
-            except Exception as e:
-                st.error(f"Authentication failed: {str(e)}")
+    # Reject callbacks this browser did not start before spending a round trip on the token endpoint
+    if browser_nonce is None:
+        params.clear()
+        st.error("This browser has no record of starting the sign-in, so it could not be completed. Please sign in again.")
+        return False
+    if not _state_is_valid(params.get('state'), str(browser_nonce)):
+        params.clear()
+        st.error("The sign-in response could not be verified. Please sign in again.")
+        return False
     
-    if not st.session_state.get('google_credentials'):
-        st.write("Please sign in with your Google account to access your calendar.")
-        
-        if st.button("Sign in with Google", key="google_login"):
-            try:
-                flow = Flow.from_client_config(
-                    get_client_config(),
-                    scopes=[
-                        'https://www.googleapis.com/auth/calendar',
-                        'https://www.googleapis.com/auth/calendar.events',
-                        'https://www.googleapis.com/auth/calendar.readonly'
-                    ],
-                    redirect_uri=st.secrets["REDIRECT_URI"]
-                )
-                auth_url, _ = flow.authorization_url(prompt='consent')
-                st.markdown(f"[Click here to authorize]({auth_url})")
-            except Exception as e:
-                st.error(f"Error initiating authentication: {str(e)}")
+    with st.spinner("🔐 Completing authentication..."):
+        try:
+            flow = _new_flow()
+            flow.fetch_token(code=auth_code)
+            credentials = flow.credentials
+        except Exception as e:
+            st.query_params.clear()
+            st.error(f"Authentication failed: {str(e)}")
+            return False
+    
+    # Save credentials; session state is an in-memory dict, so the object is kept as is
+    st.session_state.google_credentials = credentials
+    st.session_state.pop('_signed_out', None)
+    _remember_credentials(credentials)
+    if cookies is not None:
+        cookies.delete(OAUTH_NONCE_COOKIE, key='delete_oauth_nonce_cookie')
+    
+    # Google accepts the "primary" alias as a calendarId in every Events API call
+    st.session_state.calendar_id = 'primary'
+    
+    # The first real API call doubles as the check that the Calendar API works,
+    # so skip the separate probe in get_calendar_service
+    st.session_state['_calendar_api_verified'] = True
+    
+    # Clear the URL parameters; only start over if the code somehow survived
+    st.query_params.clear()
+    if 'code' in st.query_params:
+        st.rerun()
+    
+    st.success("Successfully authenticated with Google!")
+    return True
+
+def show_auth_screen():
+    """Display the Google authentication button."""
+    st.header("Google Calendar Authentication")
+    st.write("Please sign in with your Google account to access your calendar.")
+    
+    try:
+        auth_url = _authorization_url()
+    except Exception as e:
+        st.error(f"Error initiating authentication: {str(e)}")
+    else:
+        st.link_button("Sign in with Google", auth_url, type="primary")
     
 def is_authenticated():
     """Check if the user is authenticated."""
-    return st.session_state.get('google_credentials') is not None
+    return 'google_credentials' in st.session_state
+
+def explain_disabled_calendar_api(error):
+    """Show how to enable the Calendar API if that is why a call failed; return whether it was."""
+    if "enabled" not in str(error):
+        return False
+    st.error("Calendar API is not enabled. Please enable it in Google Cloud Console.")
+    st.markdown("Visit the [Google Cloud Console](https://console.cloud.google.com/apis/library/calendar-json.googleapis.com) to enable the Calendar API.")
+    return True
+
+@st.cache_resource(show_spinner=False)
+def _calendar_discovery_document():
+    """Read the Calendar discovery document bundled with the client, once per process."""
+    from googleapiclient.discovery_cache import get_static_doc
+    
+    return get_static_doc('calendar', 'v3')
+
+def _build_service(credentials):
+    """Build a calendar service with its own authorized transport.
+
+    httplib2 is not thread-safe and every session runs on its own thread, so
+    the transport is never shared between sessions; only the discovery
+    document is.
+    """
+    import google_auth_httplib2
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+    
+    # The session keeps this transport, so its keep-alive connection to
+    # googleapis.com stays open across reruns instead of handshaking per call
+    http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=60))
+    
+    # Build from the bundled discovery document instead of fetching it
+    return build_from_document(_calendar_discovery_document(), http=http)
 
 def get_calendar_service():
     """Return an authenticated calendar service if available."""
-    if is_authenticated():
-        try:
-            credentials_dict = json.loads(st.session_state.google_credentials)
-            credentials = Credentials.from_authorized_user_info(credentials_dict)
-            service = build('calendar', 'v3', credentials=credentials)
-            
-            # Test the service with a minimal API call
+    credentials = st.session_state.get('google_credentials')
+    if credentials is not None:
+        # One service per session; credentials are refreshed in place, so it is
+        # only rebuilt when a new sign-in replaces the Credentials object
+        cached = st.session_state.get('_calendar_service')
+        if cached is not None and cached[0] is credentials:
+            service = cached[1]
+        else:
+            try:
+                service = _build_service(credentials)
+            except Exception as e:
+                st.error(f"Error creating calendar service: {str(e)}")
+                return None
+            st.session_state['_calendar_service'] = (credentials, service)
+        
+        # Check once per session that the Calendar API is enabled and reachable
+        if not st.session_state.get('_calendar_api_verified'):
             try:
                 service.calendarList().list(maxResults=1).execute()
-                return service
             except Exception as e:
-                if "enabled" in str(e):
-                    st.error("Calendar API is not enabled. Please enable it in Google Cloud Console.")
-                    st.markdown("Visit the [Google Cloud Console](https://console.cloud.google.com/apis/library/calendar-json.googleapis.com) to enable the Calendar API.")
-                else:
+                if not explain_disabled_calendar_api(e):
                     st.error(f"Error connecting to Calendar API: {str(e)}")
                 return None
-                
-        except Exception as e:
-            st.error(f"Error creating calendar service: {str(e)}")
-            return None
+            st.session_state['_calendar_api_verified'] = True
+        return service
     return None
 
 def get_calendar_id():
@@ -156,9 +458,12 @@ def get_calendar_id():
 
 def logout():
     """Clear the stored credentials."""
-    if 'google_credentials' in st.session_state:
-        del st.session_state.google_credentials
-    if 'calendar_id' in st.session_state:
-        del st.session_state.calendar_id
-    st.success("Logged out successfully!")
-    st.rerun()
\ No newline at end of file
+    st.session_state.pop('google_credentials', None)
+    st.session_state.pop('calendar_id', None)
+    st.session_state.pop('_calendar_api_verified', None)
+    st.session_state.pop('_calendar_service', None)
+    st.session_state.pop('_refresh_job', None)
+    # Used as a button callback, so the cookie is deleted during the following
+    # run, and the stale cookie value that run may still read is not restored
+    st.session_state['_signed_out'] = True
+    st.success("Logged out successfully!")
\ No newline at end of file
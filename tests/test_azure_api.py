@@ -0,0 +1,93 @@
+import pytest
+
+import azure_api
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    azure_api._RESPONSE_CACHE.clear()
+    yield
+    azure_api._RESPONSE_CACHE.clear()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(azure_api.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_cache_key_collapses_whitespace_but_keeps_case():
+    text, hour = azure_api._cache_key("  Lunch with   Sam\ttomorrow ")
+    assert text == "Lunch with Sam tomorrow"
+    assert hour == azure_api.get_current_date().strftime("%Y-%m-%d-%H")
+
+
+def test_cached_response_expires_after_ttl(clock):
+    key = ("hello", "2026-01-01-10")
+    response = {"action": "message", "content": "hi"}
+    azure_api._remember_response(key, response)
+    assert azure_api._cached_response(key) == response
+
+    clock[0] += azure_api._RESPONSE_CACHE_TTL + 1
+    assert azure_api._cached_response(key) is None
+    assert key not in azure_api._RESPONSE_CACHE
+
+
+def test_errors_are_not_cached(clock):
+    key = ("hello", "2026-01-01-10")
+    azure_api._remember_response(key, {"action": "error", "content": "boom"})
+    assert azure_api._cached_response(key) is None
+
+
+def test_cache_evicts_least_recently_used(clock, monkeypatch):
+    monkeypatch.setattr(azure_api, "_RESPONSE_CACHE_SIZE", 2)
+    for name in ("a", "b"):
+        azure_api._remember_response((name, "h"), {"action": "message"})
+    azure_api._cached_response(("a", "h"))
+    azure_api._remember_response(("c", "h"), {"action": "message"})
+    assert list(azure_api._RESPONSE_CACHE) == [("a", "h"), ("c", "h")]
+
+
+@pytest.mark.parametrize("text", ["", "   \n"])
+def test_empty_stream_is_an_error(text):
+    assert azure_api.parse_streamed_response(text)["action"] == "error"
+
+
+def test_streamed_tool_arguments_are_parsed():
+    assert azure_api.parse_streamed_response(' {"action": "find", "summary": "Gym"} ') == {
+        "action": "find",
+        "summary": "Gym",
+    }
+
+
+@pytest.mark.parametrize("text", ["null", "42", '["a"]', "Sure, which day?"])
+def test_non_object_stream_is_a_message(text):
+    assert azure_api.parse_streamed_response(text) == {"action": "message", "content": text}
+
+
+@pytest.mark.parametrize("use_simdjson", [True, False])
+@pytest.mark.parametrize("body", [
+    b'{"choices": {}}',
+    b'{"choices": []}',
+    b'{"choices": [{"message": 3}]}',
+    b'{"choices": [1]}',
+    b'[1]',
+    b'{}',
+])
+def test_first_message_of_wrongly_shaped_response_is_empty(monkeypatch, body, use_simdjson):
+    if use_simdjson and azure_api.simdjson is None:
+        pytest.skip("pysimdjson is not installed")
+    if not use_simdjson:
+        monkeypatch.setattr(azure_api, "simdjson", None)
+    assert azure_api._first_message(body) == {}
+
+
+@pytest.mark.parametrize("use_simdjson", [True, False])
+def test_first_message(monkeypatch, use_simdjson):
+    if use_simdjson and azure_api.simdjson is None:
+        pytest.skip("pysimdjson is not installed")
+    if not use_simdjson:
+        monkeypatch.setattr(azure_api, "simdjson", None)
+    body = b'{"choices": [{"message": {"role": "assistant", "content": "hi"}}], "usage": {}}'
+    assert azure_api._first_message(body) == {"role": "assistant", "content": "hi"}
@@ -0,0 +1,65 @@
+import pytest
+
+import google_oauth
+
+
+@pytest.fixture(autouse=True)
+def fake_secrets(monkeypatch):
+    monkeypatch.setattr(google_oauth, "_secrets", lambda: ("client-id", "client-secret", "http://localhost"))
+
+
+def test_new_state_is_valid():
+    state = google_oauth._new_state()
+    assert google_oauth._state_is_valid(state)
+    assert google_oauth._state_is_valid(state, browser_nonce=state.split(":")[0])
+
+
+def test_state_rejects_tampered_signature():
+    nonce, issued_ns, signature = google_oauth._new_state().split(":")
+    tampered = "0" if signature[-1] != "0" else "1"
+    assert not google_oauth._state_is_valid(f"{nonce}:{issued_ns}:{signature[:-1]}{tampered}")
+
+
+def test_state_rejects_other_nonce():
+    state = google_oauth._new_state()
+    assert not google_oauth._state_is_valid(state, browser_nonce="someone-else")
+
+
+@pytest.mark.parametrize("state", [None, "", "a:b", "a:b:c:d", "nonce:not-a-number:sig", "nonce:1:sïg"])
+def test_state_rejects_malformed_values(state):
+    assert not google_oauth._state_is_valid(state)
+
+
+def test_state_expires(monkeypatch):
+    state = google_oauth._new_state()
+    issued_ns = int(state.split(":")[1])
+    monkeypatch.setattr(google_oauth.time, "time_ns", lambda: issued_ns + google_oauth.STATE_MAX_AGE_NS)
+    assert not google_oauth._state_is_valid(state)
+
+
+def test_state_from_the_future_is_rejected(monkeypatch):
+    state = google_oauth._new_state()
+    issued_ns = int(state.split(":")[1])
+    monkeypatch.setattr(google_oauth.time, "time_ns", lambda: issued_ns - 1)
+    assert not google_oauth._state_is_valid(state)
+
+
+def test_refresh_token_round_trip():
+    sealed = google_oauth._seal_refresh_token("1//refresh:token")
+    assert google_oauth._unseal_refresh_token(sealed) == "1//refresh:token"
+
+
+@pytest.mark.parametrize("value", [None, 42, "", "no-signature", ":abc"])
+def test_unseal_rejects_malformed_values(value):
+    assert google_oauth._unseal_refresh_token(value) is None
+
+
+def test_unseal_rejects_swapped_token():
+    _, _, signature = google_oauth._seal_refresh_token("mine").rpartition(":")
+    assert google_oauth._unseal_refresh_token(f"theirs:{signature}") is None
+
+
+def test_state_signature_does_not_seal_a_token():
+    # The two signatures use different payloads, so one cannot stand in for the other
+    nonce, issued_ns, signature = google_oauth._new_state().split(":")
+    assert google_oauth._unseal_refresh_token(f"{nonce}:{issued_ns}:{signature}") is None
@@ -0,0 +1,89 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import user_event_handler
+from user_event_handler import IST, CalendarCtx
+
+
+def test_naive_time_is_read_as_ist():
+    parsed = user_event_handler._to_ist("2026-03-01T09:30:00")
+    assert parsed == datetime(2026, 3, 1, 9, 30, tzinfo=IST)
+
+
+@pytest.mark.parametrize("value", ["2026-03-01T04:00:00Z", "2026-03-01T04:00:00+00:00"])
+def test_aware_time_is_converted_to_ist(value):
+    parsed = user_event_handler._to_ist(value)
+    assert parsed.utcoffset() == timedelta(hours=5, minutes=30)
+    assert parsed.isoformat() == "2026-03-01T09:30:00+05:30"
+
+
+def test_ist_day_bounds():
+    assert user_event_handler._ist_day_bounds(date(2026, 12, 31)) == (
+        "2026-12-31T00:00:00+05:30",
+        "2027-01-01T00:00:00+05:30",
+    )
+
+
+class FakeBatch:
+    def __init__(self, callback, failing_ids):
+        self.callback = callback
+        self.failing_ids = failing_ids
+        self.requests = []
+
+    def add(self, request):
+        self.requests.append(request)
+
+    def execute(self):
+        for request_id, event_id in enumerate(self.requests):
+            error = RuntimeError(event_id) if event_id in self.failing_ids else None
+            self.callback(str(request_id), None, error)
+
+
+class FakeEvents:
+    def delete(self, calendarId, eventId):
+        return eventId
+
+
+class FakeService:
+    def __init__(self, failing_ids=()):
+        self.failing_ids = set(failing_ids)
+        self.batches = []
+
+    def events(self):
+        return FakeEvents()
+
+    def new_batch_http_request(self, callback):
+        batch = FakeBatch(callback, self.failing_ids)
+        self.batches.append(batch)
+        return batch
+
+
+def test_delete_in_batches_collects_errors():
+    service = FakeService(failing_ids={"e1", "e3"})
+    ctx = CalendarCtx(service=service, calendar_id="primary", token="token")
+    events = [{"id": f"e{i}"} for i in range(5)]
+
+    errors = user_event_handler._delete_in_batches(ctx, events)
+
+    assert [str(error) for error in errors] == ["e1", "e3"]
+
+
+def test_delete_in_batches_splits_into_batch_size_chunks():
+    service = FakeService()
+    ctx = CalendarCtx(service=service, calendar_id="primary", token="token")
+    events = [{"id": f"e{i}"} for i in range(user_event_handler.BATCH_SIZE * 2 + 1)]
+
+    assert user_event_handler._delete_in_batches(ctx, events) == []
+    assert [len(batch.requests) for batch in service.batches] == [
+        user_event_handler.BATCH_SIZE,
+        user_event_handler.BATCH_SIZE,
+        1,
+    ]
+
+
+def test_delete_in_batches_with_no_events_sends_nothing():
+    service = FakeService()
+    ctx = CalendarCtx(service=service, calendar_id="primary", token="token")
+    assert user_event_handler._delete_in_batches(ctx, []) == []
+    assert service.batches == []
@@ -1,10 +1,10 @@
 import streamlit as st
+import html
 from azure_api import call_azure_openai
-from google_oauth import setup_google_oauth, show_auth_screen, is_authenticated, get_calendar_service, get_calendar_id, logout
-from user_event_handler import handle_calendar_action
-import urllib.parse
-from datetime import datetime, timedelta
-import pytz
+from google_oauth import setup_google_oauth, handle_oauth_callback, show_auth_screen, is_authenticated, get_calendar_id, logout, explain_disabled_calendar_api
+from user_event_handler import handle_calendar_action, get_upcoming_events, invalidate_event_caches
+from datetime import datetime
+from zoneinfo import ZoneInfo
 import time
 
 # UI Setup
@@ -12,10 +12,10 @@ st.set_page_config(layout="wide", page_title="AI Calendar Assistant")
 st.title("AI-Powered Calendar Assistant")
 
 # Timezone Setup
-IST = pytz.timezone("Asia/Kolkata")
+IST = ZoneInfo("Asia/Kolkata")
 
 # Custom CSS for better styling and visibility
-st.markdown("""
+STYLES = """
 <style>
     .event-card {
         border-left: 4px solid #4285F4; 
@@ -48,19 +48,22 @@ st.markdown("""
         font-weight: bold;
         color: #202124;
     }
-    .expander-override {
-        background-color: white !important;
+    details.day-group {
+        border: 1px solid #e0e0e0;
+        border-radius: 8px;
+        margin-bottom: 10px;
+        padding: 8px;
+        background-color: white;
     }
-    div[data-testid="stExpander"] {
-        border: 1px solid #e0e0e0 !important;
-        border-radius: 8px !important;
-        margin-bottom: 10px !important;
-    }
-    div[data-testid="stExpander"] > div[role="button"] {
-        background-color: #f8f9fa !important;
+    details.day-group > summary {
+        cursor: pointer;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Streamlit drops elements that a run does not emit again, so caching the
+# injection would leave every later run unstyled
+st.markdown(STYLES, unsafe_allow_html=True)
 
 # Initialize session state for tracking changes
 if 'last_action_time' not in st.session_state:
@@ -69,21 +72,145 @@ if 'last_action_time' not in st.session_state:
 if 'refresh_requested' not in st.session_state:
     st.session_state.refresh_requested = False
 
-# Note: No separate handle_oauth_callback() call anymore - it's integrated in show_auth_screen()
+def _stream_preview(stream):
+    """Show the assistant's reply while it streams in, then clear it for the action's own output."""
+    placeholder = st.empty()
+    try:
+        with placeholder.container():
+            return st.write_stream(stream) or ""
+    finally:
+        placeholder.empty()
+
+@st.fragment
+def _render_calendar_panel(calendar_id):
+    """Render the calendar column; its own widgets rerun only this fragment."""
+    st.subheader("Your Calendar")
+    
+    # Add a manual refresh button; clicking it only reruns this panel
+    if st.button("Refresh Calendar"):
+        invalidate_event_caches()
+    
+    # Create a button to open the calendar in a new window
+    st.markdown("""
+    <a href="https://calendar.google.com/calendar/r" target="_blank" 
+       style="display: inline-block; background-color: #4285F4; color: white; 
+       padding: 10px 20px; text-decoration: none; border-radius: 5px; 
+       font-weight: bold; margin-bottom: 15px;">
+        Open Google Calendar
+    </a>
+    """, unsafe_allow_html=True)
+    
+    # Display a smaller placeholder
+    st.markdown("""
+    <div style="border: 1px solid #ddd; border-radius: 8px; padding: 10px; text-align: center; 
+                background-color: #f9f9f9; margin-bottom: 15px; height: 120px; display: flex; 
+                flex-direction: column; justify-content: center; align-items: center;">
+        <img src="https://www.gstatic.com/calendar/images/dynamiclogo_2020q4/calendar_10_2x.png" 
+             style="width: 48px; height: 48px; margin-bottom: 10px;">
+        <div style="margin: 5px 0; font-size: 18px; font-weight: bold;">Your Google Calendar</div>
+        <div style="font-size: 0.9em; color: #666; margin: 5px 0;">
+            You can use the assistant on the left to manage your calendar without leaving this page.
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Display refresh status if needed
+    if st.session_state.refresh_requested:
+        with st.spinner("Refreshing calendar data..."):
+            # Reset the flag
+            st.session_state.refresh_requested = False
+    
+    # Try to display upcoming events
+    calendar_container = st.container()
+    with calendar_container:
+        try:
+            # Cached briefly, so unrelated reruns don't hit Google
+            events = get_upcoming_events(calendar_id)
+            if events is not None:
+                if events:
+                    st.markdown("### Upcoming Events")
+                    
+                    # Group events by day, parsing each start and end only once
+                    days = {}
+                    for event in events:
+                        start = event['start']
+                        end = event.get('end', {})
+                        
+                        if 'dateTime' in start:
+                            start_dt = datetime.fromisoformat(start['dateTime']).astimezone(IST)
+                            end_dt = datetime.fromisoformat(end['dateTime']).astimezone(IST) if 'dateTime' in end else None
+                            day_key = start_dt.strftime("%Y-%m-%d")
+                        else:
+                            start_dt = datetime.strptime(start['date'], "%Y-%m-%d")
+                            end_dt = None
+                            day_key = start['date']
+                        
+                        if day_key not in days:
+                            days[day_key] = {"display": start_dt.strftime("%A, %b %d"), "events": []}
+                        days[day_key]["events"].append({
+                            "start_dt": start_dt,
+                            "end_dt": end_dt,
+                            "summary": event.get('summary', 'No title'),
+                            "location": event.get('location', ''),
+                            "all_day": 'dateTime' not in start,
+                        })
+                    
+                    # The day of the first event returned is the one shown expanded
+                    first_day = next(iter(days))
+                    
+                    # Build the whole list as one HTML blob, so the panel is a single
+                    # element instead of an expander and markdown block per day
+                    parts = []
+                    for day_key in sorted(days):
+                        day_info = days[day_key]
+                        
+                        # A collapsible section for each day
+                        parts.append('<details class="day-group" open>' if day_key == first_day else '<details class="day-group">')
+                        parts.append(f'<summary class="day-header">{day_info["display"]}</summary>')
+                        for event in day_info["events"]:
+                            if event["all_day"]:
+                                time_str = "All day"
+                            else:
+                                time_str = event["start_dt"].strftime("%I:%M %p")
+                                
+                                # If we have an end time, include it
+                                if event["end_dt"]:
+                                    time_str += f" - {event['end_dt'].strftime('%I:%M %p')}"
+                            
+                            # Titles and locations come from the user's calendar, so escape them
+                            summary = html.escape(event["summary"])
+                            location = html.escape(event["location"])
+                            
+                            parts.append(
+                                '<div class="event-card">'
+                                f'<div class="event-title">{summary}</div>'
+                                f'<div class="event-time">⏰ {time_str}</div>'
+                                + (f'<div class="event-location">📍 {location}</div>' if location else '')
+                                + '</div>'
+                            )
+                        parts.append('</details>')
+                    st.html("".join(parts))
+                else:
+                    st.info("No upcoming events found in the next 7 days.")
+        except Exception as e:
+            if not explain_disabled_calendar_api(e):
+                st.error(f"Unable to fetch upcoming events: {str(e)}")
+            st.info("You can still use the assistant to create and manage events.")
 
-# Check if the user is authenticated
-authenticated = is_authenticated()
+# Refresh stored credentials if needed, then check if the user is authenticated;
+# a fresh OAuth callback signs the user in without another rerun
+setup_google_oauth()
+authenticated = is_authenticated() or handle_oauth_callback()
 
 if not authenticated:
-    # Show authentication screen - this now handles OAuth callback internally
+    # Show authentication screen
     show_auth_screen()
 else:
     # User is authenticated, show the calendar interface
     calendar_id = get_calendar_id()
     
     # Show logout button in sidebar
-    if st.sidebar.button("Logout from Google"):
-        logout()
+    st.sidebar.button("Logout from Google", on_click=logout)
     
     col1, col2 = st.columns([0.37, 0.63])
 
@@ -96,143 +223,28 @@ else:
         - "Reschedule the Team Sync meeting to Friday at 3 PM"
         """)
         
-        user_input = st.text_area("How can I help you with your calendar?", height=150)
+        # A form only reruns the script on submit, not while the user is typing
+        with st.form("req_form", clear_on_submit=False):
+            user_input = st.text_area("How can I help you with your calendar?", height=150)
+            submitted = st.form_submit_button("Process Request 🚀", type="primary")
         
         # Event trigger for the button
-        if st.button("Process Request 🚀", type="primary"):
+        if submitted:
             if user_input.strip():
                 try:
                     # Process the request with Azure OpenAI and handle the calendar action
                     with st.spinner("Processing your request..."):
-                        response = call_azure_openai(user_input.strip())
+                        response = call_azure_openai(user_input.strip(), render=_stream_preview)
                         handle_calendar_action(response)
                         
-                        # Mark that we've made a change that requires a refresh
+                        # Mark that we've made a change that requires a refresh; the calendar
+                        # panel renders after this column, so it picks the change up in this run
                         st.session_state.last_action_time = time.time()
                         st.session_state.refresh_requested = True
-                        
-                        # Automatically rerun the app to refresh the calendar display
-                        st.rerun()
                 except Exception as e:
                     st.error(f"An error occurred: {str(e)}")
             else:
                 st.warning("Please provide a valid input before processing.")
-                
-        # Add a manual refresh button
-        if st.button("Refresh Calendar"):
-            st.session_state.refresh_requested = True
-            st.rerun()
 
     with col2:
-        st.subheader("Your Calendar")
-        
-        # Create a button to open the calendar in a new window
-        st.markdown("""
-        <a href="https://calendar.google.com/calendar/r" target="_blank" 
-           style="display: inline-block; background-color: #4285F4; color: white; 
-           padding: 10px 20px; text-decoration: none; border-radius: 5px; 
-           font-weight: bold; margin-bottom: 15px;">
-            Open Google Calendar
-        </a>
-        """, unsafe_allow_html=True)
-        
-        # Display a smaller placeholder
-        st.markdown("""
-        <div style="border: 1px solid #ddd; border-radius: 8px; padding: 10px; text-align: center; 
-                    background-color: #f9f9f9; margin-bottom: 15px; height: 120px; display: flex; 
-                    flex-direction: column; justify-content: center; align-items: center;">
-            <img src="https://www.gstatic.com/calendar/images/dynamiclogo_2020q4/calendar_10_2x.png" 
-                 style="width: 48px; height: 48px; margin-bottom: 10px;">
-            <div style="margin: 5px 0; font-size: 18px; font-weight: bold;">Your Google Calendar</div>
-            <div style="font-size: 0.9em; color: #666; margin: 5px 0;">
-                You can use the assistant on the left to manage your calendar without leaving this page.
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        # Display refresh status if needed
-        if st.session_state.refresh_requested:
-            with st.spinner("Refreshing calendar data..."):
-                # Reset the flag
-                st.session_state.refresh_requested = False
-        
-        # Try to display upcoming events
-        calendar_container = st.container()
-        with calendar_container:
-            try:
-                calendar_service = get_calendar_service()
-                if calendar_service:
-                    # Get events for the next 7 days
-                    now = datetime.now(IST)
-                    time_min = now.isoformat()
-                    time_max = (now + timedelta(days=7)).isoformat()
-                    
-                    events_result = calendar_service.events().list(
-                        calendarId=calendar_id,
-                        timeMin=time_min,
-                        timeMax=time_max,
-                        maxResults=10,
-                        singleEvents=True,
-                        orderBy='startTime'
-                    ).execute()
-                    
-                    events = events_result.get('items', [])
-                    
-                    if events:
-                        st.markdown("### Upcoming Events")
-                        
-                        # Group events by day
-                        days = {}
-                        for event in events:
-                            start = event['start'].get('dateTime', event['start'].get('date'))
-                            
-                            if 'dateTime' in event['start']:
-                                start_dt = datetime.fromisoformat(start.replace('Z', '+00:00')).astimezone(IST)
-                                day_key = start_dt.strftime("%Y-%m-%d")
-                                day_display = start_dt.strftime("%A, %b %d")
-                            else:
-                                start_dt = datetime.strptime(start, "%Y-%m-%d")
-                                day_key = start
-                                day_display = start_dt.strftime("%A, %b %d")
-                            
-                            if day_key not in days:
-                                days[day_key] = {"display": day_display, "events": []}
-                            days[day_key]["events"].append(event)
-                        
-                        # Display events grouped by day
-                        for day_key in sorted(days.keys()):
-                            day_info = days[day_key]
-                            
-                            # Create an expander for each day
-                            with st.expander(day_info["display"], expanded=(day_key == list(days.keys())[0])):
-                                for event in day_info["events"]:
-                                    start = event['start'].get('dateTime', event['start'].get('date'))
-                                    
-                                    if 'dateTime' in event['start']:
-                                        start_dt = datetime.fromisoformat(start.replace('Z', '+00:00')).astimezone(IST)
-                                        time_str = start_dt.strftime("%I:%M %p")
-                                        
-                                        # If we have an end time, include it
-                                        if 'dateTime' in event.get('end', {}):
-                                            end_dt = datetime.fromisoformat(event['end']['dateTime'].replace('Z', '+00:00')).astimezone(IST)
-                                            time_str += f" - {end_dt.strftime('%I:%M %p')}"
-                                    else:
-                                        time_str = "All day"
-                                    
-                                    summary = event.get('summary', 'No title')
-                                    location = event.get('location', '')
-                                    
-                                    # Instead of using HTML markdown, use st.container for better visibility
-                                    with st.container():
-                                        st.markdown(f"""
-                                        <div class="event-card">
-                                            <div class="event-title">{summary}</div>
-                                            <div class="event-time">⏰ {time_str}</div>
-                                            {f'<div class="event-location">📍 {location}</div>' if location else ''}
-                                        </div>
-                                        """, unsafe_allow_html=True)
-                    else:
-                        st.info("No upcoming events found in the next 7 days.")
-            except Exception as e:
-                st.error(f"Unable to fetch upcoming events: {str(e)}")
-                st.info("You can still use the assistant to create and manage events.")
\ No newline at end of file
+        _render_calendar_panel(calendar_id)
\ No newline at end of file
@@ -1,10 +1,71 @@
 import streamlit as st
+from dataclasses import dataclass
+from typing import Any
 from datetime import datetime, timedelta
-import pytz
+from zoneinfo import ZoneInfo
+import time
 from google_oauth import get_calendar_service, get_calendar_id
 
 # Timezone Setup
-IST = pytz.timezone("Asia/Kolkata")
+IST = ZoneInfo("Asia/Kolkata")
+
+# Partial responses: only the event fields the app reads are sent back
+EVENT_LIST_FIELDS = "items(id,summary,location,start(dateTime,date),end(dateTime,date)),nextPageToken"
+EVENT_ID_FIELDS = "items(id),nextPageToken"
+
+@st.cache_data(ttl=30, show_spinner=False, max_entries=100)
+def _upcoming_events(_service, token, calendar_id, minute, epoch):
+    """Fetch the next 7 days of events, starting at the given minute.
+
+    The access token is part of the key so one user's events are never
+    served to another; the service itself is left out of the hash. A new
+    epoch skips entries cached before the session's last change.
+    """
+    now = datetime.fromtimestamp(minute * 60, IST)
+    return _service.events().list(
+        calendarId=calendar_id,
+        timeMin=now.isoformat(),
+        timeMax=(now + timedelta(days=7)).isoformat(),
+        maxResults=10,
+        singleEvents=True,
+        orderBy='startTime',
+        fields=EVENT_LIST_FIELDS
+    ).execute().get('items', [])
+
+def get_upcoming_events(calendar_id):
+    """Return the user's events for the next 7 days, or None if the calendar is unavailable."""
+    service = get_calendar_service()
+    if not service:
+        return None
+    
+    # Quantize to the minute so reruns within it share a cache entry
+    token = st.session_state.google_credentials.token
+    return _upcoming_events(service, token, calendar_id, int(time.time() // 60), _events_epoch())
+
+def _events_epoch():
+    return st.session_state.get('_events_epoch', 0)
+
+def invalidate_event_caches():
+    """Make this session's next render and search skip event lists cached before now.
+
+    Only this session moves to a new epoch, so other users keep their cached lists.
+    """
+    st.session_state['_events_epoch'] = _events_epoch() + 1
+
+@dataclass(frozen=True)
+class CalendarCtx:
+    """The signed-in user's calendar service and the calendar that actions apply to."""
+    service: Any
+    calendar_id: str
+    token: str
+
+def get_calendar_ctx():
+    """Return the signed-in user's CalendarCtx, or None when there is no usable service."""
+    service = get_calendar_service()
+    calendar_id = get_calendar_id()
+    if not service or not calendar_id:
+        return None
+    return CalendarCtx(service, calendar_id, st.session_state.google_credentials.token)
 
 def handle_calendar_action(params):
     """Dispatches calendar actions to appropriate handlers using user's credentials."""
@@ -12,33 +73,31 @@ def handle_calendar_action(params):
         st.warning("Invalid or missing action in the response.")
         return
     
-    # Get the user's calendar service and ID
-    service = get_calendar_service()
-    calendar_id = get_calendar_id()
+    action = params["action"]
+    event_data = params.get("event", {})
     
-    if not service or not calendar_id:
-        st.error("Not authenticated with Google. Please sign in first.")
+    handler = ACTION_HANDLERS.get(action)
+    if handler is None:
+        st.warning(f"Unsupported action: {action}")
         return
 
-    action_handlers = {
-        "message": handle_message,
-        "error": handle_error,
-        "find": lambda data: find_events(data, service, calendar_id),
-        "create": lambda data: create_event(data, service, calendar_id),
-        "delete": lambda data: delete_event(data, service, calendar_id),
-        "reschedule": lambda data: reschedule_event(data, service, calendar_id),
-    }
-
-    action = params["action"]
-    event_data = params.get("event", {})
+    # Replies from the assistant carry their text at the top level and never touch the calendar
+    ctx = None
+    if action in ("message", "error"):
+        event_data = params
+    else:
+        # Get the user's calendar service and ID
+        ctx = get_calendar_ctx()
+        if ctx is None:
+            st.error("Not authenticated with Google. Please sign in first.")
+            return
 
-    handler = action_handlers.get(action, lambda _: st.warning(f"Unsupported action: {action}"))
     try:
-        handler(event_data)
+        handler(event_data, ctx)
     except Exception as e:
         st.error(f"Error executing {action} action: {str(e)}")
 
-def handle_message(event_data):
+def handle_message(event_data, ctx=None):
     """Displays message from the assistant."""
     content = event_data.get("content", "").strip()
     if content:
@@ -46,11 +105,49 @@ def handle_message(event_data):
     else:
         st.warning("Received an empty response. Please try again.")
 
-def handle_error(event_data):
+def handle_error(event_data, ctx=None):
     """Displays error messages."""
     st.error(event_data.get("content", "An error occurred"))
 
-def find_events(event_data, service, calendar_id):
+def _to_ist(value):
+    """Parse an ISO timestamp, reading one without an offset as IST rather than server-local time."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=IST)
+    return parsed.astimezone(IST)
+
+def _ist_day_bounds(day):
+    """Return the RFC 3339 start and end of a calendar day in IST."""
+    start = datetime(day.year, day.month, day.day, tzinfo=IST)
+    return start.isoformat(), (start + timedelta(days=1)).isoformat()
+
+# The largest page events().list will return
+EVENT_PAGE_SIZE = 2500
+
+def _list_all_events(service, **kwargs):
+    """List events, following nextPageToken until every page has been fetched."""
+    events = []
+    request = service.events().list(**kwargs)
+    while request is not None:
+        response = request.execute()
+        events.extend(response.get("items", []))
+        request = service.events().list_next(request, response)
+    return events
+
+@st.cache_data(ttl=30, show_spinner=False, max_entries=100)
+def _list_events(_service, token, calendar_id, time_min, time_max, epoch):
+    """List every event in a range, cached per user and epoch so repeated searches skip the API."""
+    return _list_all_events(
+        _service,
+        calendarId=calendar_id,
+        timeMin=time_min,
+        timeMax=time_max,
+        singleEvents=True,
+        orderBy="startTime",
+        fields=EVENT_LIST_FIELDS
+    )
+
+def find_events(event_data, ctx):
     """Finds events within a specified time range."""
     start_time = event_data.get("start_time")
     end_time = event_data.get("end_time", start_time)
@@ -60,17 +157,15 @@ def find_events(event_data, service, calendar_id):
         return
 
     # Convert to RFC 3339 format with timezone
-    start_time = datetime.fromisoformat(start_time).astimezone(IST).isoformat()
-    end_time = datetime.fromisoformat(end_time).astimezone(IST).isoformat()
+    start = _to_ist(start_time)
+    end = _to_ist(end_time)
+    
+    # An empty range would always come back empty, so search the whole day from the start
+    if end <= start:
+        end = start + timedelta(days=1)
 
     try:
-        events = service.events().list(
-            calendarId=calendar_id,
-            timeMin=start_time,
-            timeMax=end_time,
-            singleEvents=True,
-            orderBy="startTime"
-        ).execute().get("items", [])
+        events = _list_events(ctx.service, ctx.token, ctx.calendar_id, start.isoformat(), end.isoformat(), _events_epoch())
 
         if events:
             st.write("**Found Events:**")
@@ -82,7 +177,7 @@ def find_events(event_data, service, calendar_id):
     except Exception as e:
         st.error(f"Failed to fetch events: {str(e)}")
 
-def create_event(event_data, service, calendar_id):
+def create_event(event_data, ctx):
     """Creates a new event in Google Calendar and displays details."""
     required_fields = ["start_time", "summary"]
     missing_fields = [field for field in required_fields if not event_data.get(field)]
@@ -110,12 +205,31 @@ def create_event(event_data, service, calendar_id):
 
     try:
         with st.spinner("Creating event..."):
-            created_event = service.events().insert(calendarId=calendar_id, body=event).execute()
+            created_event = ctx.service.events().insert(calendarId=ctx.calendar_id, body=event).execute()
+            invalidate_event_caches()
             st.success(f"✅ Event '{event['summary']}' created successfully!")
     except Exception as e:
         st.error(f"Failed to create event: {str(e)}")
         
-def delete_event(event_data, service, calendar_id):
+# Google accepts at most 50 calls in one batch request
+BATCH_SIZE = 50
+
+def _delete_in_batches(ctx, events):
+    """Delete events with one batched HTTP request per BATCH_SIZE events and return the per-event errors."""
+    errors = []
+
+    def on_deleted(request_id, response, exception):
+        if exception is not None:
+            errors.append(exception)
+
+    for i in range(0, len(events), BATCH_SIZE):
+        batch = ctx.service.new_batch_http_request(callback=on_deleted)
+        for event in events[i:i + BATCH_SIZE]:
+            batch.add(ctx.service.events().delete(calendarId=ctx.calendar_id, eventId=event["id"]))
+        batch.execute()
+    return errors
+
+def delete_event(event_data, ctx):
     """Delete events based on title or within a specific date range, including today."""
     event_title = event_data.get("summary", "")
     start_time = event_data.get("start_time", None)
@@ -127,41 +241,53 @@ def delete_event(event_data, service, calendar_id):
 
     # If the user requested to delete "today's events"
     if not start_time:
-        today = datetime.now(IST).date()
-        start_time = datetime.combine(today, datetime.min.time()).astimezone(IST).isoformat()
-        end_time = datetime.combine(today, datetime.max.time()).astimezone(IST).isoformat()
-
-    if start_time and not end_time:
-        end_time = (datetime.fromisoformat(start_time) + timedelta(days=1)).astimezone(IST).isoformat()
+        start_time, end_time = _ist_day_bounds(datetime.now(IST).date())
+    else:
+        # Google requires an RFC 3339 offset on both bounds
+        start = _to_ist(start_time)
+        end = _to_ist(end_time) if end_time else start + timedelta(days=1)
+        start_time, end_time = start.isoformat(), end.isoformat()
 
     try:
         # Fetch events in the specified time range
         with st.spinner("Finding events to delete..."):
-            events_query = service.events().list(
-                calendarId=calendar_id,
+            events = _list_all_events(
+                ctx.service,
+                calendarId=ctx.calendar_id,
                 timeMin=start_time,
                 timeMax=end_time,
                 singleEvents=True,
+                maxResults=EVENT_PAGE_SIZE,
+                fields=EVENT_ID_FIELDS,
                 # Only use q parameter if we're looking for a specific event title
                 **({"q": event_title} if event_title else {})
-            ).execute()
-
-            events = events_query.get("items", [])
+            )
 
         if events:
             # Immediately delete events
             with st.spinner(f"Deleting {len(events)} events..."):
-                for event in events:
-                    service.events().delete(calendarId=calendar_id, eventId=event["id"]).execute()
+                errors = _delete_in_batches(ctx, events)
+                deleted = len(events) - len(errors)
+                if deleted:
+                    invalidate_event_caches()
 
-                st.success(f"✅ Deleted {len(events)} events successfully!")
+                if errors:
+                    st.error(f"Deleted {deleted} of {len(events)} events; {len(errors)} failed: {errors[0]}")
+                else:
+                    st.success(f"✅ Deleted {len(events)} events successfully!")
         else:
             st.info("No matching events found for deletion.")
 
     except Exception as e:
         st.error(f"Error while deleting events: {str(e)}")
 
-def reschedule_event(event_data, service, calendar_id):
+def _with_time_zone(date_time, original):
+    """Return an event time for date_time that keeps the original time's zone, if it had one."""
+    if original.get("timeZone"):
+        return {"dateTime": date_time, "timeZone": original["timeZone"]}
+    return {"dateTime": date_time}
+
+def reschedule_event(event_data, ctx):
     """Reschedules an existing event."""
     event_title = event_data.get("summary")
     new_start_time = event_data.get("new_start_time")
@@ -174,11 +300,12 @@ def reschedule_event(event_data, service, calendar_id):
     try:
         # First find the event
         with st.spinner("Finding event to reschedule..."):
-            events = service.events().list(
-                calendarId=calendar_id,
+            events = ctx.service.events().list(
+                calendarId=ctx.calendar_id,
                 q=event_title,
                 singleEvents=True,
-                maxResults=1  # We'll take the first matching event
+                maxResults=1,  # We'll take the first matching event
+                fields="items(id,start,end)"
             ).execute().get("items", [])
 
         if events:
@@ -202,21 +329,35 @@ def reschedule_event(event_data, service, calendar_id):
             new_end = new_start + orig_duration
             new_end_time = new_end.isoformat()
             
-            # Update the event times
-            event["start"]["dateTime"] = new_start_time
-            event["end"]["dateTime"] = new_end_time
-            
-            # Update the event
+            # Send only the changed times, leaving the rest of the event untouched
             with st.spinner("Updating event..."):
-                updated_event = service.events().update(
-                    calendarId=calendar_id,
+                ctx.service.events().patch(
+                    calendarId=ctx.calendar_id,
                     eventId=event_id,
-                    body=event
+                    # Carry over the event's own zones, which also give any time
+                    # without an offset its meaning
+                    body={
+                        "start": _with_time_zone(new_start_time, event["start"]),
+                        "end": _with_time_zone(new_end_time, event["end"]),
+                    },
+                    fields="id"
                 ).execute()
+                invalidate_event_caches()
                 
                 st.success(f"✅ Rescheduled event '{event_title}' to {new_start.strftime('%B %d, %Y at %I:%M %p')}")
         else:
             st.info(f"No events found matching '{event_title}' for rescheduling.")
             
     except Exception as e:
-        st.error(f"Error while rescheduling event: {str(e)}")
\ No newline at end of file
+        st.error(f"Error while rescheduling event: {str(e)}")
+
+# Actions by name; each handler takes the event data and a CalendarCtx, which
+# is None for the assistant's own replies
+ACTION_HANDLERS = {
+    "message": handle_message,
+    "error": handle_error,
+    "find": find_events,
+    "create": create_event,
+    "delete": delete_event,
+    "reschedule": reschedule_event,
+}
\ No newline at end of file